@@ -1,7 +1,11 @@
+from contextlib import AsyncExitStack
+from datetime import time
+from functools import lru_cache
+
 from botspot.utils.deps_getters import get_scheduler
 from loguru import logger
 from pydantic import SecretStr
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class AppConfig(BaseSettings):
@@ -13,20 +17,37 @@ class AppConfig(BaseSettings):
     # Service Registry settings
     service_registry_url: str = "http://localhost:8765"
     check_interval_seconds: int = 15 * 60
-    daily_summary_time: str = "09:00"
+    daily_summary_time: time = time(9, 0)  # parsed from "HH:MM"
+
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        extra="ignore",
+        # settings are read-only after load - never copy / revalidate them
+        frozen=True,
+        revalidate_instances="never",
+    )
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        extra = "ignore"
+
+@lru_cache(maxsize=1)
+def get_settings() -> AppConfig:
+    """Get the app configuration, parsed from env / .env only once"""
+    return AppConfig()
 
 
 class App:
     name = "Service Registry Bot"
 
     def __init__(self, **kwargs):
-        self.config = AppConfig(**kwargs)
+        # explicit overrides bypass the cache, otherwise reuse the parsed settings
+        self.config = AppConfig(**kwargs) if kwargs else get_settings()
         self.scheduler = None  # Will be set up during startup
+        # Owns resources opened while running (e.g. the HTTP client), closed on shutdown
+        self.exit_stack = AsyncExitStack()
+
+    async def shutdown(self):
+        """Release all resources registered on the exit stack"""
+        await self.exit_stack.aclose()
 
     async def setup_scheduled_tasks(self):
         """Set up scheduled tasks for service monitoring"""
@@ -38,23 +59,33 @@ class App:
             check_services_and_alert,
             'interval',
             seconds=self.config.check_interval_seconds,
-            id='check_services_status'
+            id='check_services_status',
+            # Collapse backlogged runs into one and never overlap them
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=60,
+            replace_existing=True,
         )
         
-        # Parse daily summary time
-        hour, minute = map(int, self.config.daily_summary_time.split(":"))
-        
         # Daily summary at configured time
         self.scheduler.add_job(
             daily_services_summary,
             'cron',
-            hour=hour,
-            minute=minute,
-            id='daily_services_summary'
+            hour=self.config.daily_summary_time.hour,
+            minute=self.config.daily_summary_time.minute,
+            id='daily_services_summary',
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=60,
+            replace_existing=True,
         )
         
         logger.info(
             f"Scheduled tasks set up:\n"
             f"- Status check every {self.config.check_interval_seconds // 60} minutes {self.config.check_interval_seconds % 60} seconds\n"
-            f"- Daily summary at {self.config.daily_summary_time}"
+            f"- Daily summary at {self.config.daily_summary_time:%H:%M}"
         )
+
+
+# Shared app instance - import this instead of creating new App() objects
+app = App()
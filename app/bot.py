@@ -39,7 +39,7 @@ def main(debug=False) -> None:
     # Setup dispatcher with our components
     bm.setup_dispatcher(dp)
 
-    # Start polling
+    # Start polling - aiogram runs it on uvloop when it is installed
     dp.run_polling(bot)
 
 
@@ -0,0 +1,41 @@
+"""Shared HTTP client for the service registry API."""
+
+import httpx
+
+from app.app import app
+
+# Read once - the registry URL doesn't change at runtime
+API_URL: str = app.config.service_registry_url
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared registry API client, creating it on first use.
+    It is closed together with the other app resources on shutdown."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=API_URL,
+            http2=True,
+            timeout=httpx.Timeout(5.0, connect=1.0),
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+        )
+        app.exit_stack.push_async_callback(_close_client)
+    return _client
+
+
+async def _close_client():
+    """Close the shared client - a later get_client() call opens a new one"""
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def is_transient_error(exc: Exception) -> bool:
+    """Whether a failed registry request is worth retrying - connection problems
+    and 5xx responses are, 4xx responses are not"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
@@ -1,16 +1,21 @@
 """Main router for the service registry bot."""
 
+import asyncio
+from contextlib import suppress
+
+import httpx
+import orjson
 from aiogram import Router, html
 from aiogram.filters import Command, CommandStart
 from aiogram.types import Message
 from botspot.components import bot_commands_menu
-from botspot.utils import send_safe
+from loguru import logger
 
-from app.app import App
+from app.app import app
 from app.routers import status, settings
+from app.utils import get_services_cached, rate_limited_send
 
 router = Router()
-app = App()
 
 # Include sub-routers
 router.include_router(status.router)
@@ -20,7 +25,7 @@ router.include_router(settings.router)
 @bot_commands_menu.add_command("start", "Start the bot")
 @router.message(CommandStart())
 async def start_handler(message: Message):
-    await send_safe(
+    await rate_limited_send(
         message.chat.id,
         f"Hello, {html.bold(message.from_user.full_name)}!\n"
         f"Welcome to {app.name}!\n"
@@ -32,7 +37,7 @@ async def start_handler(message: Message):
 @router.message(Command("help"))
 async def help_handler(message: Message):
     """Basic help command handler"""
-    await send_safe(
+    await rate_limited_send(
         message.chat.id,
         f"This is {app.name}. Use /start to begin.\n"
         "Available commands:\n"
@@ -53,7 +58,33 @@ async def help_handler(message: Message):
     )
 
 
+async def _warm_up_registry():
+    """Open the registry connection and fill the /services cache ahead of the first command"""
+    try:
+        await get_services_cached()
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.warning(f"Service registry warm-up failed: {e!r}")
+
+
+# Keep a reference so the warm-up task isn't garbage collected while running
+_warm_up_task: asyncio.Task | None = None
+
+
 @router.startup()
 async def on_startup():
-    """Setup scheduled tasks on startup"""
+    """Setup scheduled tasks and warm up the registry connection on startup"""
+    global _warm_up_task
     await app.setup_scheduled_tasks()
+    # Don't hold up polling on a slow registry
+    _warm_up_task = asyncio.create_task(_warm_up_registry())
+
+
+@router.shutdown()
+async def on_shutdown():
+    """Release the HTTP client and other resources on shutdown"""
+    # Stop the warm-up first - it would otherwise use the client closed below
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _warm_up_task
+    await app.shutdown()
@@ -0,0 +1,99 @@
+"""Helpers shared by the service registry bot routers."""
+
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Mapping
+
+import httpx
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message
+from botspot.components.features.ask_user_handler import ask_user_choice
+from loguru import logger
+
+from app.utils import get_services_cached, rate_limited_send
+
+# Shared read-only stand-in for a missing dict field, instead of a fresh {} per lookup
+EMPTY: Mapping = MappingProxyType({})
+
+
+class RegistryErrorsMiddleware(BaseMiddleware):
+    """Report failed service registry requests to the user.
+    Only httpx errors are caught here - anything else is a bug
+    and goes to the global error handler."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        except httpx.HTTPStatusError as e:
+            logger.warning(f"Service registry request failed: {e}")
+            text = f"❌ Service registry error ({e.response.status_code}), please try again later."
+        except httpx.HTTPError as e:
+            logger.warning(f"Service registry request failed: {e!r}")
+            text = "❌ Service registry is unavailable, please try again later."
+        await rate_limited_send(event.chat.id, text)
+
+
+# describe -> (services payload, choices rendered from it).
+# The cached payload object is only replaced when the registry returns new data
+_choices_cache: Dict[Callable[[dict], str], tuple[dict, Dict[str, str]]] = {}
+
+
+def format_service_choices(services: dict, describe: Callable[[dict], str]) -> Dict[str, str]:
+    """Format services as choices for ask_user_choice.
+    Returns a dict of {service_key: "<display name> (<describe(service)>)"}.
+    The result is reused while the same services payload is passed in."""
+    cached = _choices_cache.get(describe)
+    if cached is not None and cached[0] is services:
+        return cached[1]
+
+    choices = {
+        service_key: f"{service['display_name']} ({describe(service)})"
+        for service_key, service in services.items()
+    }
+    _choices_cache[describe] = (services, choices)
+    return choices
+
+
+async def resolve_service_key(
+    message: Message,
+    state: FSMContext,
+    prompt: str,
+    describe: Callable[[dict], str],
+    service_key: str | None = None,
+) -> str | None:
+    """Get the service a command is about - the given key, or ask the user to choose one.
+    Returns None (after notifying the user) if there are no services to choose from,
+    the user cancelled, or the given service doesn't exist."""
+    services = await get_services_cached()
+
+    # If no service key provided, ask user to choose one
+    if service_key is None:
+        if not services:
+            await rate_limited_send(
+                message.chat.id, "No services registered yet.", parse_mode="Markdown"
+            )
+            return None
+
+        service_key = await ask_user_choice(
+            message.chat.id,
+            prompt,
+            format_service_choices(services, describe),
+            state,
+            cleanup=True,
+        )
+        if not service_key:  # User cancelled or timeout
+            await rate_limited_send(message.chat.id, "Operation cancelled.", parse_mode="Markdown")
+            return None
+        return service_key
+
+    if service_key not in services:
+        await rate_limited_send(
+            message.chat.id, f"Service '{service_key}' not found.", parse_mode="Markdown"
+        )
+        return None
+    return service_key
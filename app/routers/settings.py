@@ -6,100 +6,58 @@ This module handles commands related to service configuration:
 - Other service-specific settings
 """
 
-import httpx
-from aiogram import Router
-from aiogram.filters import Command
+from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from botspot.components import bot_commands_menu
-from botspot.components.features.ask_user_handler import ask_user_choice
-from botspot.utils import send_safe
-from typing import Dict
 
-from app.utils import get_api_url
+from app.routers._common import EMPTY, RegistryErrorsMiddleware, resolve_service_key
+from app.utils import configure_service, get_services_cached, rate_limited_send
 
 router = Router()
+# All handlers here are commands - let plain text skip the whole router with one check
+router.message.filter(F.text.startswith("/"))
+router.message.middleware(RegistryErrorsMiddleware())
 
 
-async def _get_service_choices() -> Dict[str, str]:
-    """Get available services as choices for ask_user_choice.
-    Returns a dict of {service_key: display_text}"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{get_api_url()}/services")
-        response.raise_for_status()
-        services = response.json()
-
-    choices = {}
-    for service_key, service in services.items():
-        # Use display name if available
-        display_name = service["display_name"]
-        alerts_enabled = service.get("alerts_enabled", True)
-        status = "🔔 Enabled" if alerts_enabled else "🔕 Disabled"
-        choices[service_key] = f"{display_name} ({status})"
-
-    return choices
+def _describe_alerts(service: dict) -> str:
+    """Alerts state shown next to the service name in choices"""
+    return "🔔 Enabled" if service.get("alerts_enabled", True) else "🔕 Disabled"
 
 
 @bot_commands_menu.add_command("toggle_alerts", "Enable/disable alerts for a service")
 @router.message(Command("toggle_alerts"))
-async def toggle_alerts_handler(message: Message, state: FSMContext):
+async def toggle_alerts_handler(message: Message, command: CommandObject, state: FSMContext):
     """Handle toggle alerts command.
     Usage: /toggle_alerts <service_key>"""
-    # Parse service key from command
-    parts = message.text.strip().split(maxsplit=1)
-
-    # If no service key provided, ask user to choose one
-    if len(parts) < 2:
-        choices = await _get_service_choices()
-        if not choices:
-            await send_safe(message.chat.id, "No services registered yet.", parse_mode="Markdown")
-            return
-
-        service_key = await ask_user_choice(
-            message.chat.id,
-            "Which service would you like to toggle alerts for?",
-            choices,
-            state,
-            cleanup=True,
-        )
-        if not service_key:  # User cancelled or timeout
-            await send_safe(message.chat.id, "Operation cancelled.", parse_mode="Markdown")
-            return
-    else:
-        service_key = parts[1].strip()
-
-    api_url = get_api_url()
+    # aiogram has already split off the command - the rest is the service key
+    service_key = await resolve_service_key(
+        message,
+        state,
+        "Which service would you like to toggle alerts for?",
+        _describe_alerts,
+        (command.args or "").strip() or None,
+    )
+    if service_key is None:
+        return
 
     # Get current service state
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{api_url}/services")
-        response.raise_for_status()
-        services = response.json()
-
-    if service_key not in services:
-        await send_safe(
-            message.chat.id, f"Service '{service_key}' not found.", parse_mode="Markdown"
-        )
-        return
+    services = await get_services_cached()
 
     # Toggle alerts
     current_state = services[service_key]["alerts_enabled"]
     new_state = not current_state
 
     # Update service
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{api_url}/configure-service",
-            json={"service_key": service_key, "alerts_enabled": new_state},
-        )
-        response.raise_for_status()
+    await configure_service(service_key, alerts_enabled=new_state)
 
     # Get display name
     display_name = services[service_key]["display_name"]
 
     # Send confirmation with emoji
     state_str = "enabled 🔔" if new_state else "disabled 🔕"
-    await send_safe(
+    await rate_limited_send(
         message.chat.id,
         f"✅ Alerts {state_str} for service '{display_name}'",
         parse_mode="Markdown",
@@ -108,73 +66,37 @@ async def toggle_alerts_handler(message: Message, state: FSMContext):
 
 @bot_commands_menu.add_command("set_service_name", "Set a display name for a service")
 @router.message(Command("set_service_name"))
-async def set_service_name_handler(message: Message, state: FSMContext):
+async def set_service_name_handler(message: Message, command: CommandObject, state: FSMContext):
     """Handle set service name command.
     Usage: /set_service_name <service_key> <display_name>"""
     # Parse command arguments
-    parts = message.text.strip().split(maxsplit=2)
-
-    # If no service key provided, ask user to choose one
-    if len(parts) < 2:
-        choices = await _get_service_choices()
-        if not choices:
-            await send_safe(message.chat.id, "No services registered yet.", parse_mode="Markdown")
-            return
-
-        service_key = await ask_user_choice(
-            message.chat.id,
-            "Which service would you like to rename?",
-            choices,
-            state,
-            cleanup=True,
-        )
-        if not service_key:  # User cancelled or timeout
-            await send_safe(message.chat.id, "Operation cancelled.", parse_mode="Markdown")
-            return
-
-        # Now ask for the display name
-        await send_safe(
-            message.chat.id,
-            "Please enter the new display name for the service:",
-            parse_mode="Markdown",
-        )
+    parts = (command.args or "").split(maxsplit=1)
+
+    service_key = await resolve_service_key(
+        message,
+        state,
+        "Which service would you like to rename?",
+        _describe_alerts,
+        parts[0] if parts else None,
+    )
+    if service_key is None:
         return
 
     # If we have service key but no display name
-    if len(parts) < 3:
-        service_key = parts[1].strip()
-        await send_safe(
+    if len(parts) < 2:
+        await rate_limited_send(
             message.chat.id,
             "Please enter the new display name for the service:",
             parse_mode="Markdown",
         )
         return
 
-    service_key = parts[1].strip()
-    display_name = parts[2].strip()
-    api_url = get_api_url()
-
-    # Check if service exists
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{api_url}/services")
-        response.raise_for_status()
-        services = response.json()
-
-    if service_key not in services:
-        await send_safe(
-            message.chat.id, f"❌ Service '{service_key}' not found.", parse_mode="Markdown"
-        )
-        return
+    display_name = parts[1].strip()
 
     # Update service with new display name
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{api_url}/configure-service",
-            json={"service_key": service_key, "display_name": display_name},
-        )
-        response.raise_for_status()
+    await configure_service(service_key, display_name=display_name)
 
-    await send_safe(
+    await rate_limited_send(
         message.chat.id,
         f"✅ Display name for service '{service_key}' set to '{display_name}'",
         parse_mode="Markdown",
@@ -183,48 +105,24 @@ async def set_service_name_handler(message: Message, state: FSMContext):
 
 @bot_commands_menu.add_command("settings", "Show current settings for a service")
 @router.message(Command("settings"))
-async def settings_handler(message: Message, state: FSMContext):
+async def settings_handler(message: Message, command: CommandObject, state: FSMContext):
     """Handle settings command.
     Usage: /settings <service_key>"""
-    # Parse service key from command
-    parts = message.text.strip().split(maxsplit=1)
-
-    # If no service key provided, ask user to choose one
-    if len(parts) < 2:
-        choices = await _get_service_choices()
-        if not choices:
-            await send_safe(message.chat.id, "No services registered yet.", parse_mode="Markdown")
-            return
-
-        service_key = await ask_user_choice(
-            message.chat.id,
-            "Which service would you like to see settings for?",
-            choices,
-            state,
-            cleanup=True,
-        )
-        if not service_key:  # User cancelled or timeout
-            await send_safe(message.chat.id, "Operation cancelled.", parse_mode="Markdown")
-            return
-    else:
-        service_key = parts[1].strip()
-
-    api_url = get_api_url()
-
-    # Get service details
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{api_url}/services")
-        response.raise_for_status()
-        services = response.json()
-
-    if service_key not in services:
-        await send_safe(
-            message.chat.id, f"Service '{service_key}' not found.", parse_mode="Markdown"
-        )
+    # aiogram has already split off the command - the rest is the service key
+    service_key = await resolve_service_key(
+        message,
+        state,
+        "Which service would you like to see settings for?",
+        _describe_alerts,
+        (command.args or "").strip() or None,
+    )
+    if service_key is None:
         return
 
+    # Get service details
+    services = await get_services_cached()
     service = services[service_key]
-    metadata = service.get("metadata", {}) or {}
+    metadata = service.get("metadata") or EMPTY
 
     # Format settings message
     lines = [
@@ -245,4 +143,4 @@ async def settings_handler(message: Message, state: FSMContext):
             for key, value in metadata_display.items():
                 lines.append(f"• {key}: {value}")
 
-    await send_safe(message.chat.id, "\n".join(lines), parse_mode="Markdown")
+    await rate_limited_send(message.chat.id, "\n".join(lines), parse_mode="Markdown")
@@ -6,71 +6,101 @@ This module handles commands related to service status:
 - Service state transition history
 """
 
-from collections import defaultdict
+import asyncio
+import io
+import time
+from contextlib import suppress
+from itertools import groupby
+from operator import itemgetter
 
 import httpx
-from aiogram import Router
-from aiogram.filters import Command
+from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from botspot.components import bot_commands_menu
-from botspot.components.features.ask_user_handler import ask_user_choice
-from botspot.utils import send_safe
-from datetime import datetime, timedelta
+from datetime import datetime
 from loguru import logger
-from typing import Dict
+from typing import Iterator
 
-from app.utils import get_api_url
+from app.http import API_URL, get_client
+from app.routers._common import EMPTY, RegistryErrorsMiddleware, resolve_service_key
+from app.utils import get_registry_snapshot, get_services_cached, parse_json, rate_limited_send
 
 router = Router()
+# All handlers here are commands - let plain text skip the whole router with one check
+router.message.filter(F.text.startswith("/"))
+router.message.middleware(RegistryErrorsMiddleware())
+
+# Order of status display
+_STATUS_ORDER = ("down", "unknown", "dead", "alive")
+_STATUS_RANK = {status: rank for rank, status in enumerate(_STATUS_ORDER)}
+_STATUS_EMOJI = {"down": "➖", "unknown": "❓", "dead": "⚫️", "alive": "➕"}
+_STATUS_HEADERS = {
+    status: f"{emoji} *{status.title()}:*" for status, emoji in _STATUS_EMOJI.items()
+}
+_SERVICES_STATUS_HEADER = "*Services Status:*\n"
+
+# Status message templates
+_GROUP_HEADER_FMT = "\n  📁 *%s:*"
+_LINE_FMT = "- `%-25s`  (%s ago)"
+_HEARTBEATS_FMT = "\n    Heartbeats: %s%s"
+_INTERVAL_FMT = ", interval: %.1fs"
+_METADATA_FMT = "\n    Metadata: %s"
+_METADATA_ITEM_FMT = "%s: %s"
+
+# Transition emoji: plus sign for back online, minus sign for down/dead
+_TRANSITION_EMOJI = {"alive": "➕", "down": "➖", "dead": "➖"}
+# Seconds per unit for "N units ago"
+_MINUTE = 60
+_HOUR = 60 * _MINUTE
+_DAY = 24 * _HOUR
+
+# Telegram caps messages at 4096 chars - leave some headroom
+MAX_MESSAGE_LENGTH = 4000
 
 
 def format_service_line(service_key: str, status_data: dict, include_details: bool = False) -> str:
     """Format a single service line"""
     time_since = status_data.get("time_since_last_heartbeat_readable", "never")
     # Get service info
-    service = status_data.get("service", {})
+    service = status_data.get("service") or EMPTY
     display_name = service.get("display_name") or service_key
     # Add dash before the line
-    line = f"- `{display_name:25}`  ({time_since} ago)"
+    line = _LINE_FMT % (display_name, time_since)
 
     if include_details:
         count = status_data["heartbeat_count"]
         interval = status_data.get("median_interval")
-        interval_str = f", interval: {interval:.1f}s" if interval else ""
-        line += f"\n    Heartbeats: {count}{interval_str}"
+        interval_str = _INTERVAL_FMT % interval if interval else ""
+        line += _HEARTBEATS_FMT % (count, interval_str)
 
         # Add metadata if present
-        if service.get("metadata"):
-            meta_str = ", ".join(f"{k}: {v}" for k, v in service.get("metadata", {}).items())
-            line += f"\n    Metadata: {meta_str}"
+        metadata = service.get("metadata")
+        if metadata:
+            meta_str = ", ".join([_METADATA_ITEM_FMT % item for item in metadata.items()])
+            line += _METADATA_FMT % meta_str
 
     return line
 
 
-def format_transition(transition: dict) -> str:
-    """Format a single state transition"""
-    timestamp = datetime.fromisoformat(transition["timestamp"])
-    time_ago = datetime.now() - timestamp
-    if time_ago < timedelta(minutes=1):
+def format_transition(transition: dict, now_ts: float | None = None) -> str:
+    """Format a single state transition.
+    Pass now_ts (a time.time() value) to share one "now" across many transitions."""
+    if now_ts is None:
+        now_ts = time.time()
+    seconds_ago = now_ts - datetime.fromisoformat(transition["timestamp"]).timestamp()
+    if seconds_ago < _MINUTE:
         time_str = "just now"
-    elif time_ago < timedelta(hours=1):
-        minutes = int(time_ago.total_seconds() / 60)
-        time_str = f"{minutes} minutes ago"
-    elif time_ago < timedelta(days=1):
-        hours = int(time_ago.total_seconds() / 3600)
-        time_str = f"{hours} hours ago"
+    elif seconds_ago < _HOUR:
+        time_str = f"{int(seconds_ago // _MINUTE)} minutes ago"
+    elif seconds_ago < _DAY:
+        time_str = f"{int(seconds_ago // _HOUR)} hours ago"
     else:
-        days = int(time_ago.total_seconds() / 86400)
-        time_str = f"{days} days ago"
-
-    # Add emoji based on transition type
-    if transition["to_state"] == "alive":
-        emoji = "➕"  # Plus sign for back online
-    elif transition["to_state"] in ["down", "dead"]:
-        emoji = "➖"  # Minus sign for down/dead
-    else:
-        emoji = "❓"  # Question mark for unknown
+        time_str = f"{int(seconds_ago // _DAY)} days ago"
+
+    # Add emoji based on transition type, question mark for unknown
+    emoji = _TRANSITION_EMOJI.get(transition["to_state"], "❓")
 
     line = f"{emoji} {transition['from_state']} → {transition['to_state']} ({time_str})"
     if transition.get("alert_message"):
@@ -78,155 +108,195 @@ def format_transition(transition: dict) -> str:
     return line
 
 
-def format_services_status(
+def _iter_status_sections(
     services: dict, include_dead: bool = False, include_details: bool = False
-) -> list[str]:
-    """Format services status grouped by status and then by service group"""
-    # Group services by status and then by group
-    by_status_and_group = defaultdict(lambda: defaultdict(list))
-    for service_key, data in sorted(services.items()):
+) -> Iterator[str]:
+    """Yield the formatted block of each non-empty status, in display order"""
+    # One row per service, sorted once by (status order, group, key).
+    # Unrecognized statuses count as unknown
+    unknown_rank = _STATUS_RANK["unknown"]
+    rows = []
+    for service_key, data in services.items():
         service = data["service"]
-        status = service.get("status", "unknown")
+        rank = _STATUS_RANK.get(service.get("status", "unknown"), unknown_rank)
         group = service.get("service_group", "Ungrouped")  # Default group for services without one
-        by_status_and_group[status][group].append((service_key, data))
-
-    lines = ["*Services Status:*\n"]
-
-    # Order of status display
-    status_order = ["down", "unknown"] + (["dead"] if include_dead else []) + ["alive"]
-    status_emoji = {"down": "➖", "unknown": "❓", "dead": "⚫️", "alive": "➕"}
-
-    # Add each status group
-    for status in status_order:
-        services_by_group = by_status_and_group.get(status, {})
-        if services_by_group:
-            # Add status header with emoji
-            lines.append(f"{status_emoji[status]} *{status.title()}:*")
-
-            # Add each group under this status
-            for group, services_in_group in sorted(services_by_group.items()):
-                # Add group header if there are multiple groups
-                if len(services_by_group) > 1:
-                    lines.append(f"  📁 *{group}:*")
-
-                # Add each service in this group
-                for service_key, data in services_in_group:
-                    service_line = format_service_line(service_key, data, include_details)
-                    # Indent service lines if we're showing groups
-                    if len(services_by_group) > 1:
-                        service_line = "    " + service_line
-                    lines.append(service_line)
+        rows.append((rank, group, service_key, data))
+    rows.sort(key=itemgetter(0, 1, 2))
+
+    for rank, status_rows in groupby(rows, key=itemgetter(0)):
+        status = _STATUS_ORDER[rank]
+        if status == "dead" and not include_dead:
+            continue
+
+        groups = [
+            (group, list(group_rows)) for group, group_rows in groupby(status_rows, itemgetter(1))
+        ]
+        # Group headers and indentation are only shown if there are multiple groups
+        show_groups = len(groups) > 1
+        line_prefix = "\n    " if show_groups else "\n"
+
+        # Every line is written as "\n" + line
+        buf = io.StringIO()
+        write = buf.write  # skip the attribute lookup in the per-service loop
+        # Add status header with emoji
+        write("\n")
+        write(_STATUS_HEADERS[status])
+
+        # Add each group under this status
+        for group, group_rows in groups:
+            if show_groups:
+                write(_GROUP_HEADER_FMT % group)
+
+            # Add each service in this group
+            for _, _, service_key, data in group_rows:
+                write(line_prefix)
+                write(format_service_line(service_key, data, include_details))
+
+            # Add space between groups if there are multiple
+            if show_groups:
+                write("\n")
+
+        # Add space between status sections
+        write("\n")
+        yield buf.getvalue()
 
-                # Add space between groups if there are multiple
-                if len(services_by_group) > 1:
-                    lines.append("")
 
-            # Add space between status sections
-            lines.append("")
-
-    return lines
-
-
-async def _get_services_status() -> dict:
-    """Helper to get services status from API"""
-    api_url = get_api_url()
-    logger.info(f"Checking services status at {api_url}")
+def format_services_status(
+    services: dict, include_dead: bool = False, include_details: bool = False
+) -> str:
+    """Format services status grouped by status and then by service group"""
+    buf = io.StringIO()
+    buf.write(_SERVICES_STATUS_HEADER)
+    for section in _iter_status_sections(services, include_dead, include_details):
+        buf.write(section)
+    return buf.getvalue()
+
+
+def _split_message(text: str, max_length: int) -> Iterator[str]:
+    """Split text on line boundaries into non-empty pieces of at most max_length chars"""
+    text = text.strip("\n")
+    if len(text) <= max_length:
+        if text:
+            yield text
+        return
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{api_url}/status")
-        response.raise_for_status()
-        return response.json()["services"]
+    lines, size = [], 0
+    for line in text.split("\n"):
+        if lines and size + len(line) > max_length:
+            piece = "\n".join(lines).strip("\n")
+            if piece:  # a run of blank lines is not worth a message
+                yield piece
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    piece = "\n".join(lines).strip("\n")
+    if piece:
+        yield piece
+
+
+def iter_status_chunks(
+    services: dict,
+    include_dead: bool = False,
+    include_details: bool = False,
+    max_length: int = MAX_MESSAGE_LENGTH,
+) -> Iterator[str]:
+    """Same as format_services_status, but split into messages of at most max_length chars.
+    Whole status sections are packed into a message while they fit; a section too long
+    on its own is split on line boundaries. Each message is yielded as soon as it's full."""
+    buf = _SERVICES_STATUS_HEADER
+    for section in _iter_status_sections(services, include_dead, include_details):
+        if len(buf) + len(section) <= max_length:
+            buf += section
+        elif len(section) <= max_length:
+            yield from _split_message(buf, max_length)
+            buf = section
+        else:
+            # Keep the tail of the split section to pack the next sections after it
+            *full, buf = _split_message(buf + section, max_length)
+            yield from full
+    yield from _split_message(buf, max_length)
+
+
+async def _get_services_status(include_dead: bool = True) -> dict:
+    """Helper to get services status from API.
+    Without include_dead, dead services are filtered out by the registry"""
+    logger.info(f"Checking services status at {API_URL}")
+
+    # Status is always revalidated - an unchanged status is answered with a cheap 304.
+    # Services come along so that a follow-up /settings or /history finds them cached
+    return (await get_registry_snapshot(include_dead)).status
 
 
 async def _get_service_transitions(service_key: str, limit: int = 10) -> list[dict]:
     """Helper to get service state transitions from API"""
-    api_url = get_api_url()
     logger.info(f"Getting state transitions for {service_key}")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{api_url}/state-history", params={"service_key": service_key, "limit": limit}
-        )
-        response.raise_for_status()
-        return response.json()["transitions"]
-
+    response = await get_client().get(
+        "/state-history", params={"service_key": service_key, "limit": limit}
+    )
+    response.raise_for_status()
+    return parse_json(response)["transitions"]
 
-async def _get_service_choices() -> Dict[str, str]:
-    """Get available services as choices for ask_user_choice.
-    Returns a dict of {service_key: display_text}"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{get_api_url()}/services")
-        response.raise_for_status()
-        services = response.json()
 
-    choices = {}
-    for service_key, service in services.items():
-        display_name = service["display_name"]
-        status = service.get("status", "unknown")
-        choices[service_key] = f"{display_name} ({status})"
-
-    return choices
+def _describe_status(service: dict) -> str:
+    """Status shown next to the service name in choices"""
+    return service.get("status", "unknown")
 
 
 @bot_commands_menu.add_command("history", "View service state transition history")
 @router.message(Command("history"))
-async def history_handler(message: Message, state: FSMContext):
+async def history_handler(message: Message, command: CommandObject, state: FSMContext):
     """Handle history command - shows state transitions for a service.
     Usage: /history <service_key> [limit]"""
     # Parse command arguments
-    parts = message.text.strip().split()
-
-    # If no service key provided, ask user to choose one
-    if len(parts) < 2:
-        choices = await _get_service_choices()
-        if not choices:
-            await send_safe(message.chat.id, "No services registered yet.", parse_mode="Markdown")
-            return
-
-        service_key = await ask_user_choice(
-            message.chat.id,
-            "Which service would you like to see the history for?",
-            choices,
-            state,
-            cleanup=True,
-        )
-        if not service_key:  # User cancelled or timeout
-            await send_safe(message.chat.id, "Operation cancelled.", parse_mode="Markdown")
-            return
-    else:
-        service_key = parts[1].strip()
+    parts = (command.args or "").split()
+    service_key = parts[0] if parts else None
 
     # Parse limit if provided
     try:
-        limit = int(parts[2]) if len(parts) > 2 else 10
+        limit = int(parts[1]) if len(parts) > 1 else 10
     except ValueError:
-        await send_safe(
+        await rate_limited_send(
             message.chat.id,
             "Invalid limit value. Using default (10).",
             parse_mode="Markdown",
         )
         limit = 10
 
-    # Get service details first to check if it exists and get display name
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{get_api_url()}/services")
-        response.raise_for_status()
-        services = response.json()
+    # If the key is given, fetch state transitions concurrently with the service lookup
+    transitions_task = None
+    if service_key is not None:
+        transitions_task = asyncio.create_task(_get_service_transitions(service_key, limit))
 
-    if service_key not in services:
-        await send_safe(
-            message.chat.id, f"Service '{service_key}' not found.", parse_mode="Markdown"
+    try:
+        service_key = await resolve_service_key(
+            message,
+            state,
+            "Which service would you like to see the history for?",
+            _describe_status,
+            service_key,
         )
-        return
+        if service_key is None:
+            return
 
-    # Get display name directly
-    display_name = services[service_key]["display_name"]
+        # Get state transitions
+        if transitions_task is not None:
+            transitions = await transitions_task
+        else:
+            transitions = await _get_service_transitions(service_key, limit)
+    finally:
+        # Drop the prefetch if the service wasn't found or the lookup failed. Awaiting it
+        # retrieves its outcome, so a failed prefetch isn't logged as never retrieved
+        if transitions_task is not None:
+            transitions_task.cancel()
+            with suppress(asyncio.CancelledError, httpx.HTTPError):
+                await transitions_task
 
-    # Get state transitions
-    transitions = await _get_service_transitions(service_key, limit)
+    # Get display name directly
+    display_name = (await get_services_cached())[service_key]["display_name"]
 
     if not transitions:
-        await send_safe(
+        await rate_limited_send(
             message.chat.id,
             f"No state transitions found for service '{display_name}'.",
             parse_mode="Markdown",
@@ -235,24 +305,29 @@ async def history_handler(message: Message, state: FSMContext):
 
     # Format and send transitions
     lines = [f"*State History for {display_name}:*\n"]
-    for transition in transitions:
-        lines.append(format_transition(transition))
+    # One clock read for the whole list
+    now_ts = time.time()
+    lines.extend(format_transition(transition, now_ts) for transition in transitions)
 
-    await send_safe(message.chat.id, "\n".join(lines), parse_mode="Markdown")
+    await rate_limited_send(message.chat.id, "\n".join(lines), parse_mode="Markdown")
 
 
 @bot_commands_menu.add_command("status", "Quick status check")
 @router.message(Command("status"))
 async def status_handler(message: Message):
     """Handle basic status command - shows only active services"""
-    services = await _get_services_status()
+    services = await _get_services_status(include_dead=False)
     if not services:
-        await send_safe(message.chat.id, "No services registered yet.")
+        # The registry leaves dead services out - /services (just fetched alongside,
+        # so cached) tells "all dead" apart from "nothing registered"
+        registered = await get_services_cached()
+        text = "No active services." if registered else "No services registered yet."
+        await rate_limited_send(message.chat.id, text)
         return
 
     # Format and send status (without dead services and details)
-    lines = format_services_status(services, include_dead=False, include_details=False)
-    await send_safe(message.chat.id, "\n".join(lines), parse_mode="Markdown")
+    text = format_services_status(services, include_dead=False, include_details=False)
+    await rate_limited_send(message.chat.id, text, parse_mode="Markdown")
 
 
 @bot_commands_menu.add_command("status_full", "Detailed status with all services")
@@ -261,9 +336,9 @@ async def status_full_handler(message: Message):
     """Handle full status command - shows all services with details"""
     services = await _get_services_status()
     if not services:
-        await send_safe(message.chat.id, "No services registered yet.")
+        await rate_limited_send(message.chat.id, "No services registered yet.")
         return
 
-    # Format and send status (with dead services and details)
-    lines = format_services_status(services, include_dead=True, include_details=True)
-    await send_safe(message.chat.id, "\n".join(lines), parse_mode="Markdown")
+    # Format and send status (with dead services and details), sending each message once it's full
+    for chunk in iter_status_chunks(services, include_dead=True, include_details=True):
+        await rate_limited_send(message.chat.id, chunk, parse_mode="Markdown")
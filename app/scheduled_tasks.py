@@ -1,127 +1,282 @@
+import asyncio
+import hashlib
 import httpx
-from botspot.utils import send_safe
+import stamina
+import time
 from datetime import datetime
 from loguru import logger
+from operator import itemgetter
 
-from app.app import App
-from app.routers.settings import get_api_url
+from app.app import app
+from app.http import API_URL, get_client, is_transient_error
+from app.utils import get_services_cached, parse_json, rate_limited_send
 
-app = App()
+try:
+    # C parser, much faster than datetime.fromisoformat on large registries
+    from ciso8601 import parse_datetime as parse_timestamp
+except ImportError:
+    parse_timestamp = datetime.fromisoformat
 
+# Scheduled tasks firing within this window share one /services fetch with the commands
+SNAPSHOT_MAX_AGE_SECONDS = 60
+# Display names rarely change - during an outage, alerts may take them from a payload
+# this old. Statuses are never served stale
+DISPLAY_NAMES_MAX_STALE_SECONDS = 24 * 60 * 60
 
+# An alert identical to the previous one is not sent again within this window
+ALERT_DEDUP_SECONDS = 300
+
+# Registry outages are reported to the chat after this many failed runs in a row,
+# and then at most once per interval
+REGISTRY_FAILURES_BEFORE_ALERT = 3
+REGISTRY_FAILURE_ALERT_INTERVAL_SECONDS = 60 * 60
+
+# Timestamp formats of the daily summary and of alerts
+TS_FMT = "%Y-%m-%d %H:%M:%S"
+ALERT_TS_FMT = "%d %b at %H:%M"
+
+# (digest, monotonic time sent) of the last alert message
+_last_alert: tuple[bytes, float] | None = None
+
+# Failed registry reads in a row, and when the chat was last told about them
+_registry_failures = 0
+_registry_failure_alerted_at = float("-inf")
+
+# Ride out registry blips instead of failing the whole task run
+_retry = stamina.retry(
+    on=is_transient_error, attempts=3, wait_initial=0.5, wait_jitter=0.5, wait_exp_base=2.0
+)
+
+
+async def _report_registry_failure(error: httpx.HTTPError, skipped: str | None = None):
+    """Log a failed registry read, and tell the chat once the registry keeps failing.
+    If the failure made a task skip a report the chat expects (skipped, e.g. "Daily
+    services summary"), the chat is told right away - in a single message."""
+    global _registry_failures, _registry_failure_alerted_at
+    _registry_failures += 1
+    logger.warning(f"Service registry request failed ({_registry_failures} in a row): {error!r}")
+
+    now = time.monotonic()
+    if (
+        _registry_failures >= REGISTRY_FAILURES_BEFORE_ALERT
+        and now - _registry_failure_alerted_at >= REGISTRY_FAILURE_ALERT_INTERVAL_SECONDS
+    ):
+        text = f"⚠️ Service registry is unreachable ({_registry_failures} failed checks in a row)"
+        if skipped:
+            text += f"\n{skipped} skipped"
+    elif skipped:
+        text = f"⚠️ {skipped} skipped: service registry is unreachable"
+    else:
+        return
+
+    await rate_limited_send(app.config.telegram_chat_id, text)
+    _registry_failure_alerted_at = now
+
+
+def _report_registry_success():
+    """Reset the failure count after a successful registry read"""
+    global _registry_failures
+    _registry_failures = 0
+
+
+@_retry
 async def _get_state_transitions(only_not_alerted: bool = True) -> dict:
     """Get state transitions from API"""
-    api_url = get_api_url()
-    logger.info(f"Checking state transitions at {api_url}")
+    logger.info(f"Checking state transitions at {API_URL}")
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{api_url}/state-transitions", json={"only_not_alerted": only_not_alerted}
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data
+    response = await get_client().post(
+        "/state-transitions", json={"only_not_alerted": only_not_alerted}
+    )
+    response.raise_for_status()
+    return parse_json(response)
+
+
+def _display_name(service_key: str, service_data: dict) -> str:
+    """Display name of a service, falling back to its key.
+    Works on both flat service records and ones nested under "service"."""
+    service = service_data.get("service") or service_data
+    return service.get("display_name") or service_key
 
 
-async def _get_services() -> dict:
-    """Get all services from API"""
-    api_url = get_api_url()
-    logger.info(f"Getting services from {api_url}")
+def _format_last_seen(service_data: dict) -> str:
+    """When a service was last updated, for the daily summary"""
+    updated_at = service_data.get("updated_at")
+    return f"{parse_timestamp(updated_at):{TS_FMT}}" if updated_at else "never"
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{api_url}/services")
-        response.raise_for_status()
-        return response.json()
+
+# Cleared once the registry turns out not to have the bulk endpoint
+_bulk_mark_alerted_supported = True
+
+
+@_retry
+async def _mark_alerted_bulk(service_keys: list[str]) -> bool:
+    """Mark the given services as alerted with one request.
+    Returns False if the registry has no bulk endpoint."""
+    response = await get_client().post("/mark-alerted-bulk", json={"service_keys": service_keys})
+    if response.status_code in (404, 405):
+        return False
+    response.raise_for_status()
+    return True
+
+
+@_retry
+async def _mark_alerted_one(service_key: str):
+    """Mark a single service as alerted"""
+    response = await get_client().post("/mark-alerted", json={"service_key": service_key})
+    response.raise_for_status()
+
+
+async def _mark_alerted(service_keys: list[str]):
+    """Mark transitions of the given services as alerted.
+    Uses one /mark-alerted-bulk request, falling back to concurrent
+    per-service /mark-alerted requests on registries without it.
+    Failures are only logged - unmarked transitions are reported again next run."""
+    global _bulk_mark_alerted_supported
+    if _bulk_mark_alerted_supported:
+        try:
+            if await _mark_alerted_bulk(service_keys):
+                return
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to mark {', '.join(service_keys)} as alerted: {e!r}")
+            return
+        logger.info("Registry has no bulk mark-alerted endpoint, marking services one by one")
+        _bulk_mark_alerted_supported = False
+
+    # Multiplexed over the shared connection
+    results = await asyncio.gather(
+        *(_mark_alerted_one(key) for key in service_keys), return_exceptions=True
+    )
+    for service_key, result in zip(service_keys, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to mark {service_key} as alerted: {result!r}")
+
+
+@_retry
+async def _snapshot_services(
+    max_age: float = SNAPSHOT_MAX_AGE_SECONDS, max_stale: float = 0.0
+) -> dict:
+    """Get all services, reusing a payload fetched by another task or command if it's
+    fresh enough. If the registry can't be reached, a payload fetched less than
+    max_stale seconds ago is used instead."""
+    return await get_services_cached(max_age, max_stale)
 
 
 async def check_services_and_alert():
     """Check for new state transitions and send alerts"""
-    # Get new state transitions
-    transitions = await _get_state_transitions(only_not_alerted=True)
+    # Get new state transitions. Only registry I/O is guarded here -
+    # formatting bugs should surface as errors, not as outage reports
+    try:
+        transitions = await _get_state_transitions(only_not_alerted=True)
+    except httpx.HTTPError as e:
+        await _report_registry_failure(e)
+        return
+    _report_registry_success()
     if not transitions:
         logger.debug("No new transitions to process")
         return
 
-    logger.debug(f"Retrieved {len(transitions)} non-alerted transitions")
+    logger.debug("Retrieved {} non-alerted transitions", len(transitions))
 
-    # Get all services to access their display names
-    services = await _get_services()
+    # Display names of just the alerted services. Registries that include them in
+    # transitions spare the /services lookup - which must stay after the early return
+    display_names = {
+        key: transition["display_name"]
+        for key, transition in transitions.items()
+        if transition.get("display_name")
+    }
+    missing = transitions.keys() - display_names.keys()
+    if missing:
+        try:
+            services = await _snapshot_services(max_stale=DISPLAY_NAMES_MAX_STALE_SECONDS)
+        except httpx.HTTPError as e:
+            # Still alert - with service keys in place of the missing names
+            logger.warning(f"Could not get service display names: {e!r}")
+            services = {}
+        display_names.update(
+            (key, _display_name(key, services[key])) for key in missing & services.keys()
+        )
 
-    message = ""
+    lines = []
     # Send alerts for each service
     for service_key, transition in transitions.items():
-        logger.debug(f"Sending alert for {service_key}")
-
-        # Get display name from service record if available
-        display_name = service_key
-        if service_key in services:
-            service_data = services[service_key]
-            if isinstance(service_data, dict) and "service" in service_data:
-                service = service_data["service"]
-                if (
-                    isinstance(service, dict)
-                    and "display_name" in service
-                    and service["display_name"]
-                ):
-                    display_name = service["display_name"]
-
-        # Format timestamp
-        last_seen = datetime.fromisoformat(transition.get("last_seen", transition["timestamp"]))
-        formatted_time = last_seen.strftime("%d %b at %H:%M")
+        logger.debug("Sending alert for {}", service_key)
+
+        display_name = display_names.get(service_key, service_key)
+
+        last_seen = parse_timestamp(transition.get("last_seen", transition["timestamp"]))
 
         # Format message
         emoji = "🔴" if transition["to_state"].lower() == "down" else ""
-        message += (
-            f"{emoji}{display_name} is {transition['to_state']} (Last seen {formatted_time})\n"
+        lines.append(
+            f"{emoji}{display_name} is {transition['to_state']} "
+            f"(Last seen {last_seen:{ALERT_TS_FMT}})"
         )
 
-        # Mark transitions as alerted
-        async with httpx.AsyncClient() as client:
-            await client.post(f"{get_api_url()}/mark-alerted", json={"service_key": service_key})
+    # Send alert, unless it repeats the last one - e.g. when the registry hasn't
+    # recorded the previous mark-alerted yet
+    global _last_alert
+    message = "\n".join(lines)
+    digest = hashlib.blake2b(message.encode(), digest_size=8).digest()
+    now = time.monotonic()
+    last_digest, last_sent_at = _last_alert or (None, float("-inf"))
+    if digest == last_digest and now - last_sent_at < ALERT_DEDUP_SECONDS:
+        logger.debug("Skipping duplicate alert {}", digest.hex())
+    else:
+        logger.debug("Sending message:\n{}", message)
+        await rate_limited_send(app.config.telegram_chat_id, message, parse_mode="Markdown")
+        _last_alert = (digest, now)
 
-    # Send alert
-    logger.debug(f"Sending message:\n{message}")
-    await send_safe(app.config.telegram_chat_id, message, parse_mode="Markdown")
+    # Mark transitions as alerted
+    await _mark_alerted(list(transitions))
 
 
 async def daily_services_summary():
     """Send daily summary of all services status"""
-    services = await _get_services()
+    # No stale fallback - an old payload under today's header could hide an outage,
+    # so a failed read is reported as a registry failure instead
+    try:
+        services = await _snapshot_services()
+    except httpx.HTTPError as e:
+        # The summary is daily - say why it's missing right away
+        await _report_registry_failure(e, skipped="Daily services summary")
+        return
+    # Never a stale payload here, so this is a real successful read
+    _report_registry_success()
     if not services:
         return
 
-    # Get current time for the report header
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # One "now" for the whole report - local time, as the summary is scheduled in it
+    now = datetime.now()
 
     # Format full status report
-    lines = [f"📊 *Daily Services Status Summary ({now})*\n"]
+    lines = [f"📊 *Daily Services Status Summary ({now:{TS_FMT}})*\n"]
 
     # Group services by status
     by_status = {"alive": [], "down": [], "dead": []}
     for key, service_data in services.items():
-        status = service_data["status"].lower()
-        by_status[status].append((key, service_data))
+        by_status.setdefault(service_data["status"].lower(), []).append((key, service_data))
 
     # Add alive services
     if by_status["alive"]:
         lines.append("➕ *Healthy Services:*")
-        for key, service_data in sorted(by_status["alive"]):
-            service = service_data["service"]
-            lines.append(f"- {service.display_name}")
+        lines.extend(
+            f"- {_display_name(key, service_data)}"
+            for key, service_data in sorted(by_status["alive"], key=itemgetter(0))
+        )
         lines.append("")
 
-    # Add troubled services with details
-    troubled = by_status["down"] + by_status["dead"]
+    # Add troubled services with details - anything not alive, unknown statuses included
+    troubled = sorted(
+        (row for status, rows in by_status.items() if status != "alive" for row in rows),
+        key=itemgetter(0),
+    )
     if troubled:
         lines.append("⚠️ *Services Needing Attention:*")
-        for key, service_data in sorted(troubled):
-            service = service_data["service"]
-            status = service_data["status"]
-            updated_at = datetime.fromisoformat(service_data["updated_at"])
-            lines.append(
-                f"- {service.display_name}: *{status}*\n"
-                f"  Last seen: {updated_at.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
+        lines.extend(
+            f"- {_display_name(key, service_data)}: *{service_data['status']}*\n"
+            f"  Last seen: {_format_last_seen(service_data)}"
+            for key, service_data in troubled
+        )
 
     # Send summary to configured chat
-    await send_safe(app.config.telegram_chat_id, "\n".join(lines), parse_mode="Markdown")
+    await rate_limited_send(app.config.telegram_chat_id, "\n".join(lines), parse_mode="Markdown")
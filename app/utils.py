@@ -1,6 +1,125 @@
-def get_api_url() -> str:
-    """Get API URL from environment variable"""
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
 
-    from app.router import app
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
+from botspot.utils import send_safe
+from loguru import logger
 
-    return app.config.service_registry_url
+from app.http import get_client
+
+# Telegram allows ~30 messages per second overall and about 1 per second per chat
+_global_limiter = AsyncLimiter(25, 1)
+_chat_limiters: defaultdict[int, AsyncLimiter] = defaultdict(lambda: AsyncLimiter(1, 1))
+
+# How long a fetched /services payload is reused by back-to-back commands
+SERVICES_CACHE_TTL_SECONDS = 10.0
+
+
+@dataclass
+class _CacheEntry:
+    """Last payload of a registry GET endpoint, with its ETag for revalidation"""
+
+    fetched_at: float = float("-inf")  # monotonic time
+    etag: str | None = None
+    payload: Any = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+# request URL (path and query) -> cache entry
+_cache: defaultdict[str, _CacheEntry] = defaultdict(_CacheEntry)
+
+
+class Snapshot(NamedTuple):
+    """Services and their status, as fetched together by get_registry_snapshot"""
+
+    services: dict
+    status: dict
+
+
+def parse_json(response: httpx.Response):
+    """Parse a registry API response body with orjson"""
+    return orjson.loads(response.content)
+
+
+async def get_cached(
+    path: str, ttl: float = 0.0, params: dict | None = None, max_stale: float = 0.0
+) -> Any:
+    """GET a registry endpoint, reusing a payload fetched less than ttl seconds ago.
+    Stale payloads are revalidated with If-None-Match, so an unchanged
+    registry answers 304 and the body is neither sent nor parsed again.
+    Concurrent callers on a cache miss share a single request.
+    Each distinct set of query params is cached separately.
+    If the request fails, a payload fetched less than max_stale seconds ago is returned
+    instead of raising."""
+    url = httpx.URL(path, params=params)
+    entry = _cache[str(url)]
+    async with entry.lock:
+        if time.monotonic() - entry.fetched_at < ttl:
+            return entry.payload
+
+        headers = {"If-None-Match": entry.etag} if entry.etag else None
+        try:
+            response = await get_client().get(url, headers=headers)
+            if response.status_code != 304:
+                response.raise_for_status()
+                entry.payload = parse_json(response)
+                entry.etag = response.headers.get("etag")
+        except httpx.HTTPError as e:
+            age = time.monotonic() - entry.fetched_at
+            if age >= max_stale:
+                raise
+            logger.warning(
+                f"Registry request to {url} failed, using the payload from {age:.0f}s ago: {e!r}"
+            )
+            return entry.payload
+        entry.fetched_at = time.monotonic()
+        return entry.payload
+
+
+async def get_services_cached(
+    ttl: float = SERVICES_CACHE_TTL_SECONDS, max_stale: float = 0.0
+) -> dict:
+    """Get all services from API, reusing a payload fetched less than ttl seconds ago"""
+    return await get_cached("/services", ttl, max_stale=max_stale)
+
+
+async def get_registry_snapshot(
+    include_dead: bool = True, services_ttl: float = SERVICES_CACHE_TTL_SECONDS
+) -> Snapshot:
+    """Get /services and /status concurrently over the shared client.
+    /status is always revalidated; /services is reused for services_ttl seconds,
+    so a follow-up command that picks a service doesn't fetch it again.
+    With include_dead=False the registry is asked to leave dead services out of /status."""
+    status_params = None if include_dead else {"exclude_status": "dead"}
+    services, status = await asyncio.gather(
+        get_cached("/services", services_ttl), get_cached("/status", params=status_params)
+    )
+    return Snapshot(services, status["services"])
+
+
+def invalidate_services_cache():
+    """Make the next /services read go to the API, e.g. after a service was reconfigured"""
+    _cache["/services"].fetched_at = float("-inf")
+
+
+async def configure_service(service_key: str, **settings):
+    """Update service settings (e.g. alerts_enabled, display_name) via API"""
+    response = await get_client().post(
+        "/configure-service",
+        content=orjson.dumps({"service_key": service_key, **settings}),
+        headers={"content-type": "application/json"},
+    )
+    response.raise_for_status()
+    invalidate_services_cache()
+
+
+async def rate_limited_send(chat_id: int, text: str, **kwargs):
+    """send_safe, paced to stay under Telegram's per-chat and global rate limits"""
+    async with _chat_limiters[chat_id]:
+        async with _global_limiter:
+            return await send_safe(chat_id, text, **kwargs)
@@ -0,0 +1,119 @@
+import asyncio
+from collections import defaultdict
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+
+# Fixture to set up fake environment variables
+@pytest.fixture(autouse=True)
+def mock_env_vars(monkeypatch):
+    """Mock environment variables for testing"""
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "123456789")
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Fresh /services cache backed by a scripted registry.
+    Append responses (or exceptions to raise) to registry.responses;
+    the requests made are collected in registry.requests."""
+    from app import utils
+
+    clock = Clock()
+    monkeypatch.setattr(utils, "_cache", defaultdict(utils._CacheEntry))
+    monkeypatch.setattr(utils.time, "monotonic", clock)
+
+    registry = SimpleNamespace(responses=[], requests=[], clock=clock)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        registry.requests.append(request)
+        response = registry.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = httpx.AsyncClient(base_url="http://registry", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(utils, "get_client", lambda: client)
+    return registry
+
+
+def test_304_keeps_payload(registry):
+    from app.utils import get_services_cached
+
+    registry.responses += [
+        httpx.Response(200, json={"a": {"display_name": "A"}}, headers={"etag": '"v1"'}),
+        httpx.Response(304),
+    ]
+    first = asyncio.run(get_services_cached(ttl=0))
+    second = asyncio.run(get_services_cached(ttl=0))
+
+    assert second is first
+    assert registry.requests[1].headers["if-none-match"] == '"v1"'
+
+
+def test_fresh_payload_is_not_refetched(registry):
+    from app.utils import get_services_cached
+
+    registry.responses += [httpx.Response(200, json={"a": {}})]
+    asyncio.run(get_services_cached(ttl=10))
+    registry.clock.now += 5
+    asyncio.run(get_services_cached(ttl=10))
+
+    assert len(registry.requests) == 1
+
+
+def test_error_within_max_stale_returns_stale_payload(registry):
+    from app.utils import get_services_cached
+
+    registry.responses += [httpx.Response(200, json={"a": {}}), httpx.ConnectError("down")]
+    first = asyncio.run(get_services_cached(ttl=0))
+    registry.clock.now += 30
+
+    assert asyncio.run(get_services_cached(ttl=0, max_stale=60)) is first
+
+
+@pytest.mark.parametrize(
+    "error", [httpx.ConnectError("down"), httpx.Response(503)], ids=["transport", "5xx"]
+)
+def test_error_past_max_stale_raises(registry, error):
+    from app.utils import get_services_cached
+
+    registry.responses += [httpx.Response(200, json={"a": {}}), error]
+    asyncio.run(get_services_cached(ttl=0))
+    registry.clock.now += 120
+
+    with pytest.raises(httpx.HTTPError):
+        asyncio.run(get_services_cached(ttl=0, max_stale=60))
+
+
+def test_error_without_max_stale_raises(registry):
+    from app.utils import get_services_cached
+
+    registry.responses += [httpx.Response(200, json={"a": {}}), httpx.ConnectError("down")]
+    asyncio.run(get_services_cached(ttl=0))
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(get_services_cached(ttl=0))
+
+
+def test_error_after_invalidation_raises(registry):
+    from app.utils import get_services_cached, invalidate_services_cache
+
+    registry.responses += [httpx.Response(200, json={"a": {}}), httpx.ConnectError("down")]
+    asyncio.run(get_services_cached(ttl=0))
+    invalidate_services_cache()
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(get_services_cached(ttl=0, max_stale=60))
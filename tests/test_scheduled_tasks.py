@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+
+# Fixture to set up fake environment variables
+@pytest.fixture(autouse=True)
+def mock_env_vars(monkeypatch):
+    """Mock environment variables for testing"""
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "123456789")
+
+
+TRANSITIONS = {
+    "api": {
+        "from_state": "alive",
+        "to_state": "down",
+        "timestamp": "2025-01-01T10:00:00",
+        "display_name": "API",
+    }
+}
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    """scheduled_tasks with fresh module state, a scripted registry and captured sends.
+    Set tasks.transitions to an {key: transition} dict, or to an exception to raise"""
+    from app import scheduled_tasks
+
+    state = SimpleNamespace(now=1000.0, transitions=TRANSITIONS, sent=[])
+    monkeypatch.setattr(scheduled_tasks, "_last_alert", None)
+    monkeypatch.setattr(scheduled_tasks, "_registry_failures", 0)
+    monkeypatch.setattr(scheduled_tasks, "_registry_failure_alerted_at", float("-inf"))
+    monkeypatch.setattr(scheduled_tasks, "_bulk_mark_alerted_supported", True)
+    monkeypatch.setattr(scheduled_tasks.time, "monotonic", lambda: state.now)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/state-transitions":
+            if isinstance(state.transitions, Exception):
+                raise state.transitions
+            return httpx.Response(200, json=state.transitions)
+        return httpx.Response(200, json={})
+
+    client = httpx.AsyncClient(base_url="http://registry", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(scheduled_tasks, "get_client", lambda: client)
+
+    async def send(chat_id, text, **kwargs):
+        state.sent.append(text)
+
+    monkeypatch.setattr(scheduled_tasks, "rate_limited_send", send)
+    state.module = scheduled_tasks
+    return state
+
+
+def test_duplicate_alert_is_skipped_within_window(tasks):
+    check = tasks.module.check_services_and_alert
+
+    asyncio.run(check())
+    tasks.now += 60
+    asyncio.run(check())
+    assert len(tasks.sent) == 1
+
+    # A different message goes out right away
+    tasks.transitions = {"api": {**TRANSITIONS["api"], "to_state": "dead"}}
+    asyncio.run(check())
+    assert len(tasks.sent) == 2
+
+    # The same message again once the window has passed
+    tasks.now += tasks.module.ALERT_DEDUP_SECONDS
+    asyncio.run(check())
+    assert len(tasks.sent) == 3
+
+
+def test_registry_failures_are_debounced(tasks):
+    check = tasks.module.check_services_and_alert
+    # A 4xx is not retried, so the test doesn't wait on backoff
+    tasks.transitions = httpx.HTTPStatusError(
+        "bad", request=httpx.Request("POST", "http://registry"), response=httpx.Response(400)
+    )
+
+    for _ in range(tasks.module.REGISTRY_FAILURES_BEFORE_ALERT - 1):
+        asyncio.run(check())
+    assert tasks.sent == []
+
+    asyncio.run(check())
+    assert len(tasks.sent) == 1
+    assert "unreachable" in tasks.sent[0]
+
+    # No repeats within the interval
+    for _ in range(5):
+        asyncio.run(check())
+    assert len(tasks.sent) == 1
+
+    tasks.now += tasks.module.REGISTRY_FAILURE_ALERT_INTERVAL_SECONDS
+    asyncio.run(check())
+    assert len(tasks.sent) == 2
+
+
+def test_successful_read_resets_failure_count(tasks):
+    check = tasks.module.check_services_and_alert
+    error = httpx.HTTPStatusError(
+        "bad", request=httpx.Request("POST", "http://registry"), response=httpx.Response(400)
+    )
+
+    for _ in range(tasks.module.REGISTRY_FAILURES_BEFORE_ALERT - 1):
+        tasks.transitions = error
+        asyncio.run(check())
+        tasks.transitions = {}
+        asyncio.run(check())
+
+    assert tasks.module._registry_failures == 0
+    assert tasks.sent == []
+
+
+def test_skipped_summary_is_reported_with_the_outage(tasks, monkeypatch):
+    module = tasks.module
+    error = httpx.ConnectError("down")
+
+    async def snapshot_services(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(module, "_snapshot_services", snapshot_services)
+    monkeypatch.setattr(module, "_registry_failures", module.REGISTRY_FAILURES_BEFORE_ALERT - 1)
+
+    # The failure that trips the alert also mentions the skipped summary
+    asyncio.run(module.daily_services_summary())
+    assert len(tasks.sent) == 1
+    assert "unreachable" in tasks.sent[0] and "Daily services summary" in tasks.sent[0]
+
+    # Within the alert interval the skip is still reported, on its own
+    asyncio.run(module.daily_services_summary())
+    assert len(tasks.sent) == 2
+    assert tasks.sent[1].startswith("⚠️ Daily services summary skipped")
@@ -0,0 +1,58 @@
+import pytest
+
+
+# Fixture to set up fake environment variables
+@pytest.fixture(autouse=True)
+def mock_env_vars(monkeypatch):
+    """Mock environment variables for testing"""
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "123456789")
+
+
+def make_services(count: int, name_width: int) -> dict:
+    """Fake /status payload with every status, a few groups and some metadata"""
+    statuses = ["alive", "down", "dead", "unknown"]
+    return {
+        f"service-{i:03d}": {
+            "service": {
+                "status": statuses[i % len(statuses)],
+                "display_name": f"svc-{i}-" + "x" * (i % name_width),
+                "service_group": f"group-{i % 3}",
+                "metadata": {"key": "v" * (i % 7)},
+            },
+            "time_since_last_heartbeat_readable": "5 minutes",
+            "heartbeat_count": i,
+            "median_interval": 1.5,
+        }
+        for i in range(count)
+    }
+
+
+@pytest.mark.parametrize("count", [1, 8, 29, 64, 113])
+@pytest.mark.parametrize("name_width", [5, 30])
+def test_iter_status_chunks(count, name_width):
+    from app.routers.status import format_services_status, iter_status_chunks
+
+    services = make_services(count, name_width)
+    full = format_services_status(services, include_dead=True, include_details=True)
+    expected_lines = [line for line in full.split("\n") if line.strip()]
+    longest_line = max(map(len, expected_lines))
+
+    for max_length in range(longest_line, longest_line + 400, 3):
+        chunks = list(
+            iter_status_chunks(
+                services, include_dead=True, include_details=True, max_length=max_length
+            )
+        )
+        # Telegram rejects empty messages
+        assert all(chunk.strip() for chunk in chunks)
+        assert all(len(chunk) <= max_length for chunk in chunks)
+        # Nothing lost or reordered
+        chunk_lines = [line for chunk in chunks for line in chunk.split("\n") if line.strip()]
+        assert chunk_lines == expected_lines
+
+
+def test_iter_status_chunks_no_services():
+    from app.routers.status import iter_status_chunks
+
+    assert list(iter_status_chunks({})) == ["*Services Status:*"]